@@ -1,18 +1,24 @@
+import json
 import logging
 import os
-import subprocess
+import threading
 import time
+from concurrent.futures import ALL_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+from functools import lru_cache
 
+import av
 import functions_framework
 from cloudevents.http.event import CloudEvent
 from docx import Document
 from google.api_core import exceptions as gcp_exceptions
 from google.api_core.client_options import ClientOptions
+from google.cloud import firestore
+from google.cloud import logging as cloud_logging
 from google.cloud import speech_v2 as speech
 from google.cloud import storage
 from PIL import Image
-from PyPDF2 import PdfReader
+from pypdf import PdfReader
 from pptx import Presentation
 from openpyxl import load_workbook
 
@@ -25,17 +31,60 @@ logger = logging.getLogger(__name__)
 
 # config
 REGION = "us-west1"
-#OUTPUT_BUCKET = "discovery-processed"
-LOCAL_LOG_DIR = "/tmp"
-LOCAL_LOG_PATH = "/tmp/logs.txt"
+OUTPUT_BUCKET = "discovery-processed"
+# Raw BatchRecognize JSON lands here; a second Eventarc trigger on this
+# prefix turns it into plain-text transcripts
+STT_RAW_PREFIX = "stt-raw"
+# Above this size, submit the job and exit instead of holding the
+# invocation open waiting on the operation
+SYNC_STT_MAX_BYTES = 60_000_000
+# Container corruption shows up in the first few MB — probe that much
+# instead of downloading whole media files for validation
+MEDIA_PROBE_BYTES = 4 * 1024 * 1024
 LOG_FOLDER = "logs"
 LOG_FILE_NAME = "logs.txt"
 LOG_BUCKET_NAME = "discovery-processed"
 
+# Hot-path extension sets — built once instead of per call, and frozenset
+# membership beats scanning a tuple
+AUDIO_EXTS = frozenset(
+    {".mp3", ".wav", ".flac", ".m4a", ".mkv", ".mov", ".avi", ".ogg", ".aac"}
+)
+MEDIA_EXTS = frozenset({".mp4", ".mkv", ".mp3", ".wav", ".m4a"})
+IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png"})
+
+# Extensions validate_file_helper actually knows how to check — anything
+# else is rejected before we pay for a download
+SUPPORTED_EXTS = frozenset(
+    {
+        ".mp4",
+        ".mkv",
+        ".mp3",
+        ".wav",
+        ".m4a",
+        ".jpg",
+        ".jpeg",
+        ".png",
+        ".docx",
+        ".pdf",
+        ".pptx",
+        ".xlsx",
+    }
+)
+
+# Shared pool for overlapping independent I/O-bound stages of an event;
+# the semaphore keeps concurrent STT submissions under quota
+_POOL = ThreadPoolExecutor(max_workers=4)
+_STT_SEMAPHORE = threading.Semaphore(5)
+
 # init the clients
 PROJECT_ID = os.environ.get("GCP_PROJECT")
+SPEECH_API_ENDPOINT = f"{REGION}-speech.googleapis.com"
+RECOGNIZER = f"projects/{PROJECT_ID}/locations/{REGION}/recognizers/my-recognizer"
 storage_client = None
 speech_client = None
+firestore_client = None
+cloud_logging_client = None
 
 # This might be vertex ai stuff
 # aiplatform.init(project=PROJECT_ID, location=REGION)
@@ -45,14 +94,27 @@ def init_clients():
     """
     Initialize clients only once.
     """
-    global storage_client, speech_client
+    global storage_client, speech_client, firestore_client, cloud_logging_client
+
+    if not cloud_logging_client:
+        # Routes the stdlib logger (and gcs_log shim) to Cloud Logging
+        cloud_logging_client = cloud_logging.Client()
+        cloud_logging_client.setup_logging()
+        logger.info("Initialized cloud logging client.")
 
     if not storage_client:
         storage_client = storage.Client()
         logger.info("Initialized storage client.")
 
+    if not firestore_client:
+        firestore_client = firestore.Client()
+        logger.info("Initialized firestore client.")
+
     if not speech_client:
-        speech_client = speech.SpeechClient()
+        # Regional endpoint — the recognizer lives in us-west1
+        speech_client = speech.SpeechClient(
+            client_options=ClientOptions(api_endpoint=SPEECH_API_ENDPOINT)
+        )
         logger.info("Initialized speech client.")
 
     if storage_client is None:
@@ -61,6 +123,18 @@ def init_clients():
     if speech_client is None:
         logger.error("Failed to initialize speech client!")
 
+    if firestore_client is None:
+        logger.error("Failed to initialize firestore client!")
+
+
+@lru_cache(maxsize=16)
+def get_bucket(bucket_name: str):
+    """
+    Cached Bucket handle — handlers touch the same couple of buckets on
+    every warm invocation, so construct each handle once per instance.
+    """
+    return storage_client.bucket(bucket_name)
+
 
 @functions_framework.cloud_event
 def analyze_discovery_material_ce(ce: CloudEvent):
@@ -73,35 +147,141 @@ def analyze_discovery_material_ce(ce: CloudEvent):
     event_type = ce["type"]
 
     if event_type == "google.cloud.storage.object.v1.finalized":
+        if _is_duplicate_event(ce):
+            return
+
         file_deleted = handle_new_file_or_change(ce)
 
         if file_deleted:
             return
 
+        # All these following functions attempt to do something based on the filetype
+        # NOTE: It's not neccessary that all of these will be executed
+        # So make these functions log when they are called
+        # Validation and speech-to-text are independent I/O-bound stages,
+        # so run them concurrently instead of serially
+        validate_future = _POOL.submit(validate_file, ce)
+        stt_future = _POOL.submit(speech_to_text, ce)
+        wait([validate_future, stt_future], return_when=ALL_COMPLETED)
+
         try:
-            validate_file(ce)
+            validate_future.result()
         except Exception as e:
             logger.exception(f"Error validating file : {e}")
 
-        # All these following functions attempt to do something based on the filetype
-        # NOTE: It's not neccessary that all of these will be executed
-        # So make these functions log when they are called
-        speech_to_text(ce)
+        stt_exc = stt_future.exception()
+        if isinstance(stt_exc, SttRateLimitExceeded):
+            # Fail the invocation (non-2xx) so Eventarc redelivers once
+            # the token bucket refills — the dedupe marker has to go
+            # first or the redelivery would be skipped as a duplicate
+            _release_dedupe_marker(ce)
+            raise stt_exc
+        elif stt_exc is not None:
+            # speech_to_text handles its own expected failures — anything
+            # escaping here is a bug, so keep a trace of it
+            logger.error(
+                f"❌ Unexpected speech-to-text failure: {stt_exc}", exc_info=stt_exc
+            )
 
         logger.info("To be continued! :)")
 
-def transcribe_gcs(gcs_uri: str) -> str:
+def _dedupe_doc_id(ce: CloudEvent) -> str:
+    event_data = ce.data
+    key = (
+        f"{event_data.get('bucket')}/{event_data.get('name')}"
+        f"#{event_data.get('generation')}"
+    )
+    # '/' separates path segments in Firestore document IDs
+    return key.replace("/", "|")
+
+
+def _is_duplicate_event(ce: CloudEvent) -> bool:
     """
-    Uses Speech-to-Text v2 API to transcribe audio from GCS (any length).
-    Returns the full transcript as string.
-    Uses batch_recognize for long-running transcription.
+    Eventarc occasionally redelivers the same finalized event; without a
+    check we'd transcribe and re-upload twice. Atomically create a marker
+    document keyed on (bucket, name, generation) — AlreadyExists means a
+    previous delivery already ran the pipeline. Set a 24h Firestore TTL
+    policy on the 'processed' collection to bound storage.
     """
-    api_endpoint = "us-west1-speech.googleapis.com"
-    client_options = ClientOptions(api_endpoint=api_endpoint)
-    client = speech.SpeechClient(client_options=client_options)
+    doc_id = _dedupe_doc_id(ce)
 
-    # Configure recognition
-    config = speech.RecognitionConfig(
+    try:
+        firestore_client.collection("processed").document(doc_id).create(
+            {"ts": firestore.SERVER_TIMESTAMP}
+        )
+        return False
+    except gcp_exceptions.AlreadyExists:
+        logger.info(f"🔁 Duplicate Eventarc delivery for {doc_id}; skipping.")
+        return True
+    except Exception as e:
+        # Dedupe is best-effort — never block the pipeline on it
+        logger.exception(f"❌ Dedupe check failed for {doc_id}: {e}")
+        return False
+
+
+def _release_dedupe_marker(ce: CloudEvent):
+    """
+    Drop this event's marker so a redelivery runs the pipeline again.
+    Must be called before deliberately failing an invocation to trigger
+    an Eventarc retry — otherwise the retry dies on the duplicate check.
+    """
+    doc_id = _dedupe_doc_id(ce)
+    try:
+        firestore_client.collection("processed").document(doc_id).delete()
+    except Exception as e:
+        logger.exception(f"❌ Failed to release dedupe marker {doc_id}: {e}")
+
+
+class SttRateLimitExceeded(Exception):
+    """
+    Raised when the STT token bucket is empty. The event handler lets this
+    escape (non-2xx) so Eventarc redelivers after the bucket refills.
+    """
+
+
+def _acquire_token(bucket: str = "stt", rate: float = 5, burst: float = 10):
+    """
+    Firestore-backed token bucket shared across function instances.
+    `rate` tokens refill per second up to `burst`. Raises
+    SttRateLimitExceeded when no token is available, instead of letting
+    every instance independently hammer the recognizer into 429s.
+    """
+    doc_ref = firestore_client.collection("rate_limits").document(bucket)
+
+    @firestore.transactional
+    def _take(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        now = time.time()
+
+        if snapshot.exists:
+            data = snapshot.to_dict()
+            elapsed = max(0.0, now - data.get("updated_at", now))
+            tokens = min(burst, data.get("tokens", burst) + elapsed * rate)
+        else:
+            tokens = burst
+
+        if tokens < 1:
+            raise SttRateLimitExceeded(
+                f"Token bucket '{bucket}' empty; retry after Eventarc redelivery."
+            )
+
+        transaction.set(doc_ref, {"tokens": tokens - 1, "updated_at": now})
+
+    try:
+        _take(firestore_client.transaction())
+    except SttRateLimitExceeded:
+        raise
+    except Exception as e:
+        # Rate limiting is best-effort — a Firestore outage or deadline
+        # must not block transcription
+        logger.exception(f"❌ Token bucket check failed for '{bucket}': {e}")
+
+
+def _recognition_config() -> "speech.RecognitionConfig":
+    """
+    Shared recognition settings for both the sync and fire-and-forget paths.
+    """
+    return speech.RecognitionConfig(
         auto_decoding_config=speech.AutoDetectDecodingConfig(),
         language_codes=["en-US"],
         model="long",  # Use long model for better accuracy on longer audio
@@ -110,13 +290,22 @@ def transcribe_gcs(gcs_uri: str) -> str:
         ),
     )
 
+
+def transcribe_gcs(gcs_uri: str) -> str:
+    """
+    Uses Speech-to-Text v2 API to transcribe audio from GCS (any length).
+    Returns the full transcript as string.
+    Uses batch_recognize for long-running transcription.
+    Relies on the module-level speech_client from init_clients() — no
+    per-call gRPC channel/auth setup.
+    """
     # Create file metadata for batch recognition
     file_metadata = speech.BatchRecognizeFileMetadata(uri=gcs_uri)
 
     # Create the batch recognize request
     request = speech.BatchRecognizeRequest(
-        recognizer=f"projects/{PROJECT_ID}/locations/us-west1/recognizers/my-recognizer",
-        config=config,
+        recognizer=RECOGNIZER,
+        config=_recognition_config(),
         files=[file_metadata],
         recognition_output_config=speech.RecognitionOutputConfig(
             inline_response_config=speech.InlineOutputConfig(),
@@ -125,22 +314,95 @@ def transcribe_gcs(gcs_uri: str) -> str:
 
     # Start the long-running operation
     logger.info(f"Starting transcription for {gcs_uri}...")
-    operation = client.batch_recognize(request=request)
-    
+    operation = speech_client.batch_recognize(request=request)
+
     # Wait for completion (timeout after 30 minutes for very long audio)
     response = operation.result(timeout=1800)
-    
+
     # Extract transcript from response
     transcript_parts = []
     if gcs_uri in response.results:
         for result in response.results[gcs_uri].transcript.results:
             if result.alternatives:
                 transcript_parts.append(result.alternatives[0].transcript)
-    
+
     transcript = " ".join(transcript_parts)
     return transcript.strip()
 
 
+def submit_transcribe_gcs(gcs_uri: str, bucket_name: str, file_name: str):
+    """
+    Submit a BatchRecognize job that writes its JSON output under
+    gs://OUTPUT_BUCKET/stt-raw/<source bucket>/<audio path>/ and return
+    immediately — the function doesn't sit (and bill) waiting on the
+    operation. Nesting the output under the audio object's own path lets
+    handle_stt_output_ce reconstruct where the transcript belongs.
+    """
+    request = speech.BatchRecognizeRequest(
+        recognizer=RECOGNIZER,
+        config=_recognition_config(),
+        files=[speech.BatchRecognizeFileMetadata(uri=gcs_uri)],
+        recognition_output_config=speech.RecognitionOutputConfig(
+            gcs_output_config=speech.GcsOutputConfig(
+                uri=f"gs://{OUTPUT_BUCKET}/{STT_RAW_PREFIX}/{bucket_name}/{file_name}/"
+            ),
+        ),
+    )
+
+    logger.info(f"Submitting async transcription for {gcs_uri}...")
+    speech_client.batch_recognize(request=request)
+
+
+@functions_framework.cloud_event
+def handle_stt_output_ce(ce: CloudEvent):
+    """
+    Triggered on stt-raw/*.json written by BatchRecognize. Post-processes
+    the raw JSON into a plain-text transcript.
+    """
+    init_clients()
+
+    event_data = ce.data
+    file_name = event_data.get("name")
+    bucket_name = event_data.get("bucket")
+
+    if not file_name.startswith(f"{STT_RAW_PREFIX}/") or not file_name.endswith(".json"):
+        return
+
+    # submit_transcribe_gcs nests the output under
+    # stt-raw/<source bucket>/<audio object path>/<output>.json, so the
+    # audio's original location can be recovered from the path alone
+    relative = file_name[len(STT_RAW_PREFIX) + 1 :]
+    parts = relative.split("/")
+    if len(parts) < 3:
+        logger.warning(f"Unexpected STT output path {file_name}; skipping.")
+        return
+    source_bucket = parts[0]
+    audio_path = "/".join(parts[1:-1])
+
+    blob = get_bucket(bucket_name).blob(file_name)
+    payload = json.loads(blob.download_as_bytes())
+
+    transcript_parts = []
+    for result in payload.get("results", []):
+        if result.get("alternatives"):
+            transcript_parts.append(result["alternatives"][0].get("transcript", ""))
+    transcript = " ".join(transcript_parts).strip() or "[No transcription available]"
+
+    # Mirror the sync path: same bucket and folder as the audio file
+    file_dir = get_file_path(audio_path)
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+    transcript_blob_name = f"{file_dir}/speech_to_text_transcripts/{base_name}.txt"
+
+    # Ensure "folder" exists
+    create_folder(source_bucket, f"{file_dir}/speech_to_text_transcripts")
+
+    dest_blob = get_bucket(source_bucket).blob(transcript_blob_name)
+    dest_blob.upload_from_string(transcript, content_type="text/plain")
+
+    logger.info(f"📝 Transcript uploaded to gs://{source_bucket}/{transcript_blob_name}")
+    gcs_log(f"Post-processed {file_name} → gs://{source_bucket}/{transcript_blob_name}")
+
+
 def speech_to_text(ce: CloudEvent):
     """
     Wrapper around v2 API that saves transcript in the same bucket,
@@ -151,15 +413,38 @@ def speech_to_text(ce: CloudEvent):
     bucket_name = event_data.get("bucket")
     
     ext = get_file_extension(file_name)
-    if ext not in (".mp3", ".wav", ".flac", ".m4a", ".mkv", ".mov", ".avi", ".ogg", ".aac"):
+    if ext not in AUDIO_EXTS:
         logger.info(f"Skipping speech-to-text: unsupported file type '{ext}'")
         return
 
     gcs_uri = f"gs://{bucket_name}/{file_name}"
     logger.info(f"🎧 Transcribing {gcs_uri} via Speech-to-Text v2...")
 
+    # Raises SttRateLimitExceeded when the shared bucket is dry — the
+    # event handler re-raises so Eventarc redelivers instead of us
+    # retry-storming the recognizer
+    _acquire_token()
+
+    # Large files: submit the job and exit instead of paying function
+    # CPU-seconds waiting; handle_stt_output_ce picks up the output
+    size = int(event_data.get("size") or 0)
+    if size >= SYNC_STT_MAX_BYTES:
+        try:
+            with _STT_SEMAPHORE:
+                submit_transcribe_gcs(gcs_uri, bucket_name, file_name)
+            gcs_log(f"Submitted async transcription for {gcs_uri}")
+        except gcp_exceptions.ResourceExhausted as e:
+            # Quota 429 from the API itself — surface as a rate-limit so
+            # the event is redelivered rather than logged away
+            raise SttRateLimitExceeded(str(e)) from e
+        except Exception as e:
+            logger.exception(f"❌ Async STT submission failed for {gcs_uri}: {e}")
+            gcs_log(f"Async STT submission failed for {gcs_uri}: {e}", severity="ERROR")
+        return
+
     try:
-        transcript = transcribe_gcs(gcs_uri)
+        with _STT_SEMAPHORE:
+            transcript = transcribe_gcs(gcs_uri)
         if not transcript:
             transcript = "[No transcription available]"
         
@@ -173,29 +458,26 @@ def speech_to_text(ce: CloudEvent):
         # Ensure "folder" exists
         create_folder(bucket_name, f"{file_dir}/speech_to_text_transcripts")
         
-        # Temp save local .txt
-        tmp_path = f"/tmp/{os.path.basename(transcript_blob_name)}"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            f.write(transcript)
-
-        # Upload to SAME bucket
-        dest_blob = storage_client.bucket(bucket_name).blob(transcript_blob_name)
-        dest_blob.upload_from_filename(tmp_path, content_type="text/plain")
+        # Upload to SAME bucket — straight from memory, no /tmp round trip
+        dest_blob = get_bucket(bucket_name).blob(transcript_blob_name)
+        dest_blob.upload_from_string(transcript, content_type="text/plain")
 
         logger.info(f"📝 Transcript uploaded to gs://{bucket_name}/{transcript_blob_name}")
         gcs_log(f"Transcribed {gcs_uri} → gs://{bucket_name}/{transcript_blob_name}")
-        
-        # Clean up temp file
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
 
+    except gcp_exceptions.ResourceExhausted as e:
+        # Quota 429 from the API itself — surface as a rate-limit so the
+        # event is redelivered rather than logged away
+        raise SttRateLimitExceeded(str(e)) from e
     except Exception as e:
         logger.exception(f"❌ Speech-to-text v2 failed for {gcs_uri}: {e}")
         gcs_log(f"Speech-to-text failed for {gcs_uri}: {e}", severity="ERROR")
 
+@lru_cache(maxsize=1024)
 def get_file_path(file_name):
     """
     Returns directory path WITHOUT filename, preserving nested structure.
+    Cached — the same filename is parsed by several handlers per event.
     """
     if "/" not in file_name:
         return ""
@@ -212,11 +494,19 @@ def create_folder(bucket_name: str, folder_name: str):
         if not folder_name.endswith("/"):
             folder_name += "/"
 
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(folder_name)
 
-        # Upload empty content to simulate a folder
-        blob.upload_from_string("", content_type="application/x-directory")
+        # Upload empty content to simulate a folder; if_generation_match=0
+        # makes repeats a cheap failed precondition instead of a full PUT,
+        # and guarantees we never clobber a real object at this path
+        try:
+            blob.upload_from_string(
+                "", content_type="application/x-directory", if_generation_match=0
+            )
+        except gcp_exceptions.PreconditionFailed:
+            logger.info(f"📁 Folder '{folder_name}' already exists; nothing to do.")
+            return
 
         logger.info(f"📁 Created folder '{folder_name}' in bucket '{bucket_name}'.")
     except Exception as e:
@@ -235,9 +525,19 @@ def handle_new_file_or_change(ce: CloudEvent) -> bool:
 
     if "/" not in file_name:
         logger.info(f"❌ File {file_name} uploaded at bucket root — not allowed.")
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(file_name)
-        blob.delete()
+        try:
+            # Batched ops are pipelined into one multipart request;
+            # failures surface when the context exits
+            with storage_client.batch():
+                blob.delete()
+        except Exception as e:
+            # The file still exists — re-raise so Eventarc retries the
+            # event instead of logging a deletion that never happened
+            logger.exception(f"❌ Failed to delete disallowed file {file_name}: {e}")
+            _release_dedupe_marker(ce)
+            raise
         gcs_log(
             f"Deleted disallowed file {file_name} (no files allowed at bucket root)"
         )
@@ -254,13 +554,43 @@ def validate_file(ce: CloudEvent):
     file_name = event_data.get("name")
     bucket_name = event_data.get("bucket")
 
-    tmp_path = f"/tmp/{os.path.basename(file_name)}"
-    bucket = storage_client.bucket(bucket_name)
+    ext = get_file_extension(file_name)
+    if ext not in SUPPORTED_EXTS:
+        logger.info(f"Unsupported file type for {file_name}; skipping validation.")
+        return
+
+    bucket = get_bucket(bucket_name)
     blob = bucket.blob(file_name)
-    blob.download_to_filename(tmp_path)
-    logger.info(f"📥 Downloaded {file_name} for validation.")
 
-    valid, message = validate_file_helper(tmp_path, file_name)
+    if ext in MEDIA_EXTS:
+        # ffprobe needs a real path, so media still hits /tmp —
+        # raw_download skips the client-side CRC32C pass
+        tmp_path = f"/tmp/{os.path.basename(file_name)}"
+        # Ranged GET of the leading bytes — enough for the header check
+        blob.download_to_filename(
+            tmp_path,
+            start=0,
+            end=MEDIA_PROBE_BYTES - 1,
+            raw_download=True,
+            checksum=None,
+        )
+        logger.info(f"📥 Downloaded head of {file_name} for validation.")
+        valid, message = validate_file_helper(tmp_path, file_name)
+
+        size = int(event_data.get("size") or 0)
+        if not valid and (size == 0 or size > MEDIA_PROBE_BYTES):
+            # Any failure on a truncated probe may be our own doing — a
+            # non-faststart MP4/M4A keeps its moov atom at the end, which
+            # libav reports as "moov atom not found ... Invalid data", not
+            # an EOF error. Re-check the full object before flagging it.
+            blob.download_to_filename(tmp_path, raw_download=True, checksum=None)
+            logger.info(f"📥 Re-downloaded full {file_name} after truncated probe.")
+            valid, message = validate_file_helper(tmp_path, file_name)
+    else:
+        # Everything else only needs headers/structure — stream straight
+        # from GCS instead of paying a full download into tmpfs
+        with blob.open("rb") as fh:
+            valid, message = validate_file_helper(fh, file_name)
 
     if valid:
         logger.info(message)
@@ -272,72 +602,90 @@ def validate_file(ce: CloudEvent):
         )
 
 
+@lru_cache(maxsize=1024)
 def get_file_extension(file_name: str):
     return (os.path.splitext(file_name)[1] or "").lower()
 
 
-def validate_file_helper(local_path: str, file_name: str) -> tuple[bool, str]:
+def validate_file_helper(source, file_name: str, deep: bool = False) -> tuple[bool, str]:
     """
     Validate various file types by extension/MIME.
+    `source` is a local path for media (ffprobe needs one) or an open
+    binary file-like object streamed from GCS for everything else.
+    `deep=True` runs the full image integrity walk instead of the
+    header-only magic-byte check.
     Returns (is_valid, message)
     """
     ext = get_file_extension(file_name)
 
     # Audio / video files
-    if ext in (".mp4", ".mkv", ".mp3", ".wav", ".m4a"):
-        if not os.path.exists(local_path):
-            return False, f"File download failed: {local_path} does not exist."
+    if ext in MEDIA_EXTS:
+        if not os.path.exists(source):
+            return False, f"File download failed: {source} does not exist."
         try:
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-i", local_path],
-                capture_output=True,
-                text=True,
-                timeout=30,
-            )
-            stderr_content = result.stderr.strip()
-            if result.returncode != 0 or stderr_content:
-                return (
-                    False,
-                    f"Invalid or corrupted media: {file_name}, {stderr_content or 'None-zero exit code'}",
-                )
-            else:
-                return True, f"{file_name} file passed integrity check."
-        except subprocess.CalledProcessError as e:
-            return False, f"Invalid or corrupted media: {e.stderr.strip()}"
+            # In-process libav header parse — same check ffprobe did, minus
+            # the fork/exec overhead of spawning a process per file. Small
+            # probe window: the header either parses or it doesn't.
+            with av.open(
+                source, options={"probesize": "32768", "analyzeduration": "0"}
+            ) as container:
+                _ = container.streams  # triggers header parse
+            return True, f"{file_name} file passed integrity check."
+        except av.FFmpegError as e:
+            return False, f"Invalid or corrupted media: {file_name}, {e}"
     # Image files
-    elif ext in (".jpg", ".jpeg", ".png"):
+    elif ext in IMAGE_EXTS:
         try:
-            with Image.open(local_path) as img:
-                img.verify()
+            # Magic-byte sniff: O(1) header read instead of decoding the
+            # whole stream the way Image.verify() does
+            if hasattr(source, "read"):
+                header = source.read(32)
+                source.seek(0)
+            else:
+                with open(source, "rb") as fh:
+                    header = fh.read(32)
+
+            if not (
+                header.startswith(b"\xff\xd8\xff")
+                or header.startswith(b"\x89PNG\r\n\x1a\n")
+            ):
+                return False, f"Not a valid JPEG/PNG header in {file_name}."
+
+            if deep:
+                with Image.open(source) as img:
+                    img.verify()
             return True, f"Image file is valid."
         except Exception as e:
             return False, f"Corrupted image file: {e}"
     # Docx
     elif ext == ".docx":
         try:
-            _ = Document(local_path)
+            _ = Document(source)
             return True, f"DOCX file opened successfully."
         except Exception as e:
             return False, f"Corrupted DOCX file file: {e}"
     # Pdf
     elif ext == ".pdf":
         try:
-            reader = PdfReader(local_path)
-            _ = len(reader.pages)
+            # strict=False skips noncritical recovery work — we only
+            # care whether the document opens
+            reader = PdfReader(source, strict=False)
+            if len(reader.pages) < 1:
+                return False, "PDF file has no pages."
             return True, "PDF file opened successfully."
         except Exception as e:
             return False, f"Corrupted or unreadable PDF file: {e}"
     # Pptx
     elif ext == ".pptx":
         try:
-            _ = Presentation(local_path)
+            _ = Presentation(source)
             return True, "PPTX file opened successfully."
         except Exception as e:
             return False, f"Corrupted or unreadable PPT file: {e}"
     # Xlsx
-    elif ext == ".Xlsx":
+    elif ext == ".xlsx":
         try:
-            _ = load_workbook(local_path, read_only=True)
+            _ = load_workbook(source, read_only=True)
             return True, "XLSX file opened successfully."
         except Exception as e:
             return False, f"Corrupted or unreadable XLSX file: {e}"
@@ -346,53 +694,83 @@ def validate_file_helper(local_path: str, file_name: str) -> tuple[bool, str]:
         return False, f"Unsupported file type for {file_name}; skipping validation."
 
 
-def gcs_log(message: str, severity: str = "INFO", max_retries: int = 5):
+def gcs_log(message: str, severity: str = "INFO"):
     """
-    Safely append a log entry to logs.txt in GCS with optimistic concurrency control.
-    Uses if_generation_match to avoid race conditions.
+    Thin shim kept for the migration off the GCS log bucket: entries now
+    go through the stdlib logger, which Cloud Functions ships to Cloud
+    Logging for free — structured, queryable, and zero extra RPCs.
     """
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-    log_entry = f"[{timestamp}] [{severity}]: {message}\n"
-    bucket = storage_client.bucket(LOG_BUCKET_NAME)
-    blob = bucket.blob(f"{LOG_FOLDER}/{LOG_FILE_NAME}")
-    current_generation = 0
-    upload_kwargs = {}
+    logger.log(getattr(logging, severity.upper(), logging.INFO), message)
 
-    for attempt in range(1, max_retries + 1):
-        try:
-            # Downloading existing logs + record generation
-            if blob.exists():
-                blob.reload()
-                current_generation = blob.generation
-                blob.download_to_filename(LOCAL_LOG_PATH)
-            else:
-                current_generation = 0
-                open(LOCAL_LOG_PATH, "w").close()
 
-            # Append new line locally
-            with open(LOCAL_LOG_PATH, "a") as f:
-                f.write(log_entry)
+def compact_logs(day: datetime | None = None, max_retries: int = 5):
+    """
+    Append one day's append-only log objects onto logs/logs.txt via
+    server-side compose (max 32 sources per call, so compose in chained
+    batches), then delete the source objects. No log bytes ever cross the
+    client — GCS concatenates in place, guarded by if_generation_match.
+    Meant to be run from a separate scheduled function, not the event path.
+    """
+    init_clients()
+    day = day or datetime.now(timezone.utc)
+    prefix = f"{LOG_FOLDER}/{day:%Y/%m/%d}/"
+    bucket = get_bucket(LOG_BUCKET_NAME)
 
-            # Upload with generation precondition
-            upload_kwargs = {}
-            if current_generation > 0:
-                upload_kwargs["if_generation_match"] = current_generation
+    parts = sorted(
+        bucket.list_blobs(prefix=prefix), key=lambda b: b.time_created
+    )
+    if not parts:
+        logger.info(f"No log objects under {prefix}; nothing to compact.")
+        return
 
-            blob.upload_from_filename(
-                LOCAL_LOG_PATH, content_type="text/plain", **upload_kwargs
-            )
+    main = bucket.blob(f"{LOG_FOLDER}/{LOG_FILE_NAME}")
+    pending = list(parts)
 
-            logger.info(f"🪵 Successfully appended to logs.txt on attempt {attempt}")
+    for attempt in range(1, max_retries + 1):
+        try:
+            # One metadata GET records the generation; a separate
+            # exists() HEAD before it would be a wasted round trip
+            try:
+                main.reload()
+            except gcp_exceptions.NotFound:
+                # The create response populates generation itself
+                main.upload_from_string(
+                    "", content_type="text/plain", if_generation_match=0
+                )
+
+            # Compose chains: 32-source limit per call, so fold batches
+            # onto the running main log (compose refreshes main's
+            # generation from its response)
+            while pending:
+                batch = pending[:31]
+                main.compose(
+                    [main] + batch,
+                    if_generation_match=main.generation,
+                )
+                # Delete this batch's sources before touching the next
+                # one — a retry must only replay parts that were never
+                # composed, or concurrent compactors duplicate entries
+                # (batched into one multipart request; errors raise when
+                # the context exits)
+                with storage_client.batch():
+                    for part in batch:
+                        part.delete()
+                pending = pending[31:]
+
+            logger.info(
+                f"🧹 Composed {len(parts)} log objects onto {main.name} "
+                f"on attempt {attempt}"
+            )
             return
         except gcp_exceptions.PreconditionFailed:
-            # Another process wrote before us — retry
+            # Another compactor wrote before us — re-issue the compose only
             logger.warning(f"⚠️ Generation mismatch on attempt {attempt}, retrying...")
             time.sleep(0.5 * attempt)
             continue
         except Exception as e:
-            logger.exception(f"❌ Unexpected error while writing to logs.txt: {e}")
+            logger.exception(f"❌ Failed to compact logs under {prefix}: {e}")
             return
 
-        logger.error(
-            "❌ Failed to append log after multiple retries due to concurrent writes."
-        )
+    logger.error(
+        "❌ Failed to compact logs after multiple retries due to concurrent writes."
+    )